@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 import math
 import os
@@ -15,16 +15,23 @@ import broadcasts
 from dotenv import load_dotenv
 import asyncio
 import datautils
+import hosthealth
 from urllib.parse import urlparse
 
 from pagedata import PageChangeBroadcast, PageData, PageSection
 
 
-def scout_change(pd: PageData, ps: PageSection) -> PageChangeBroadcast | None:
+REQUEST_TIMEOUT = 30.0
+
+
+def scout_change(
+    pd: PageData, ps: PageSection, health: hosthealth.HostHealthTracker
+) -> PageChangeBroadcast | None:
     history_entry: PageChangeBroadcast = None
 
     try:
         rsp: requests.Response = request_content(ps.url)
+        health.record_success(ps.url)
         soup: bs = bs(rsp.text, "html.parser").select_one("div#content")
 
         current_hash = generate_page_hash(soup)
@@ -55,8 +62,13 @@ def scout_change(pd: PageData, ps: PageSection) -> PageChangeBroadcast | None:
                     )
                 history_entry.file_count = count
 
-    except requests.exceptions.RequestException:
+    except requests.exceptions.RequestException as e:
         logger.error(f"Could not fetch page {ps.name} of {pd.name}")
+        if hosthealth.is_host_failure(e.response):
+            health.record_failure(ps.url, e.response)
+        else:
+            # Any other answer still proves the host is reachable.
+            health.record_success(ps.url)
 
     return history_entry
 
@@ -84,37 +96,49 @@ def find_files(soup: bs) -> list[str]:
 
 
 def download_and_check_files(links: list[str], pd: PageData, ps: PageSection) -> int:
+    """
+    Download every new file linked from a section.
+
+    Failed attachments are logged and skipped, they never count against the
+    health of the page's host.
+
+    :links - file urls found in the section
+    :pd - page data the section belongs to
+    :ps - page section where the links were found
+    """
     download_count: int = 0
     for link in links:
         if link:
-            head: requests.Response = requests.head(link)
-            if head.status_code == 200:
-                file_name: str = link.split("/")[-1]
-                # stored_last_modified: str = datautils.check_file_name_lastmodified(
-                #     file_name
-                # )
-                # if stored_last_modified != head.headers.get("last-modified"):
-                if (
-                    head.headers.get("content-type")
-                    in fileutils.FILE_CONTENT_TYPES.keys()
-                ):
-                    if handle_download_file(pd, ps, link, file_name):
-                        download_count += 1
-                    time.sleep(random.uniform(5.0, 10.0))
-                else:
-                    message: str = f"Found a weird content type {head.headers.get('content-type')} for file {file_name} at {pd.name}/{ps.name}."
-                    logger.warning(message)
-                    loop = asyncio.get_event_loop()
-                    loop.run_until_complete(broadcaster.to_owner(message))
-                # else:
-                #     time.sleep(random.uniform(2.0, 4.0))
+            try:
+                head: requests.Response = requests.head(link, timeout=REQUEST_TIMEOUT)
+                if head.status_code == 200:
+                    file_name: str = link.split("/")[-1]
+                    # stored_last_modified: str = datautils.check_file_name_lastmodified(
+                    #     file_name
+                    # )
+                    # if stored_last_modified != head.headers.get("last-modified"):
+                    if (
+                        head.headers.get("content-type")
+                        in fileutils.FILE_CONTENT_TYPES.keys()
+                    ):
+                        if handle_download_file(pd, ps, link, file_name):
+                            download_count += 1
+                        time.sleep(random.uniform(5.0, 10.0))
+                    else:
+                        message: str = f"Found a weird content type {head.headers.get('content-type')} for file {file_name} at {pd.name}/{ps.name}."
+                        logger.warning(message)
+                        notify_owner(broadcaster, message)
+                    # else:
+                    #     time.sleep(random.uniform(2.0, 4.0))
+            except requests.exceptions.RequestException:
+                logger.warning(f"Could not fetch file {link} of {pd.name}/{ps.name}")
     return download_count
 
 
 def handle_download_file(
     pd: PageData, ps: PageSection, link: str, file_name: str
 ) -> bool:
-    rsp: requests.Response = requests.get(link)
+    rsp: requests.Response = requests.get(link, timeout=REQUEST_TIMEOUT)
     hash: str = hashlib.md5(rsp.content).hexdigest()
 
     entry: datautils.FileHistory = datautils.FileHistory(
@@ -143,27 +167,98 @@ def handle_download_file(
     return did_download
 
 
-def scout_pages(pages: list[PageData], broadcaster: broadcasts.Broadcaster) -> None:
+def scout_pages(
+    pages: list[PageData],
+    broadcaster: broadcasts.Broadcaster,
+    digests: broadcasts.DigestQueue,
+) -> None:
+    health: hosthealth.HostHealthTracker = hosthealth.HostHealthTracker()
     while True:
         changes: list[PageChangeBroadcast] = list()
         for pd in pages:
+            fetched: bool = False
             for ps in pd.sections:
+                if not health.allow(ps.url):
+                    logger.debug(f"Skipping {ps.name} of {pd.name}, host is down.")
+                    continue
+                fetched = True
                 ps.last_attempt = datetime.utcnow()
-                change: PageChangeBroadcast = scout_change(pd, ps)
+                change: PageChangeBroadcast = scout_change(pd, ps, health)
                 if change:
                     changes.append(change)
                 time.sleep(random.uniform(2.0, 10.0))
-            time.sleep(random.uniform(2.0, 10.0))
+            if fetched:
+                time.sleep(random.uniform(2.0, 10.0))
+        # Queue digests before saving the new hashes, a crash in between may
+        # repeat a change but never lose one.
+        digests.push(changes)
+        fileutils.write_digests(digests.to_dict())
         fileutils.write_pagedata(pages)
         if changes:
             message: str = f"Found changes!{os.linesep}{os.linesep.join([entry.to_str() for entry in changes])}"
-            loop = asyncio.get_event_loop()
-            loop.run_until_complete(broadcaster.to_owner(message))
+            notify_owner(broadcaster, message)
+        deliver_digests(broadcaster, digests)
+        fileutils.write_digests(digests.to_dict())
+        outages: str = health.alerts()
+        if outages:
+            logger.warning(outages)
+            if notify_owner(broadcaster, outages):
+                health.clear_alerts()
         nap_time: int = random.uniform(1800.0, 3600.0)
         logger.info(f"Taking a nap for about {math.floor(nap_time/60)} minutes.")
         time.sleep(nap_time)
 
 
+def notify_owner(broadcaster: broadcasts.Broadcaster, message: str) -> bool:
+    """
+    Try to reach the owner, logging instead of raising when Telegram fails.
+
+    :broadcaster - broadcaster used to reach the owner
+    :message - message to send
+    """
+    try:
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(broadcaster.to_owner(message))
+    except telegram.error.TelegramError:
+        logger.exception("Could not reach the owner.")
+        return False
+    return True
+
+
+def deliver_digests(
+    broadcaster: broadcasts.Broadcaster, digests: broadcasts.DigestQueue
+) -> None:
+    """
+    Send every digest that is due, re-queueing or dropping the ones that fail.
+
+    :broadcaster - broadcaster used to reach subscribers
+    :digests - queue holding pending digests
+    """
+    ready: dict[str, list[list[PageChangeBroadcast]]] = {
+        chat_id: broadcasts.digest_chunks(changes)
+        for chat_id, changes in digests.due().items()
+    }
+    if not ready:
+        return
+    loop = asyncio.get_event_loop()
+    failures: dict[str, broadcasts.DeliveryFailure] = loop.run_until_complete(
+        broadcaster.to_subscribers(
+            {
+                chat_id: [broadcasts.render_digest(chunk) for chunk in chunks]
+                for chat_id, chunks in ready.items()
+            }
+        )
+    )
+    dropped: dict[str, broadcasts.DeliveryFailure] = digests.settle(ready, failures)
+    for chat_id, failure in failures.items():
+        if chat_id in dropped:
+            logger.error(f"Dropping digest for {chat_id}: {failure.error}")
+        else:
+            logger.warning(
+                f"Could not deliver digest to {chat_id}, retrying: {failure.error}"
+            )
+
+
 def process_changes(pages: list[PageData]) -> list[PageChangeBroadcast]:
     """
     Check and annotate where changes are.
@@ -184,11 +279,11 @@ def request_content(url: str) -> requests.Response:
 
     :url - resource to fetch
     """
-    rsp: requests.Response = requests.get(url)
+    rsp: requests.Response = requests.get(url, timeout=REQUEST_TIMEOUT)
 
     if rsp.status_code != 200:
         logger.error(f"{url} returned {rsp.status_code}")
-        raise requests.exceptions.RequestException
+        raise requests.exceptions.RequestException(response=rsp)
 
     return rsp
 
@@ -255,6 +350,23 @@ def diff_page_data(pd: PageSection, hash: str) -> bool:
     return pd.last_hash != hash
 
 
+def init_digests() -> broadcasts.DigestQueue:
+    """
+    Create the digest queue, picking up digests left pending by a previous run.
+    """
+    index: broadcasts.SubscriptionIndex = broadcasts.SubscriptionIndex(
+        fileutils.read_subscriptions()
+    )
+    window: timedelta = timedelta(
+        minutes=float(os.getenv("DIGEST_WINDOW_MINUTES", "0"))
+    )
+    try:
+        return broadcasts.DigestQueue(index, window, fileutils.read_digests())
+    except (KeyError, TypeError, ValueError):
+        logger.exception("Could not restore pending digests, starting empty.")
+        return broadcasts.DigestQueue(index, window)
+
+
 def init_broadcaster() -> broadcasts.Broadcaster:
     """
     Create and register all used services for broadcast.
@@ -285,16 +397,18 @@ if __name__ == "__main__":
     sh = logging.StreamHandler(sys.stdout)
     sh.setLevel(logging.DEBUG)
     sh.setFormatter(lf)
-    logger.addHandler(fh)
-    logger.addHandler(sh)
+    # Handlers live on the root logger so other modules' warnings land here too.
+    logging.getLogger().addHandler(fh)
+    logging.getLogger().addHandler(sh)
 
     logger.info("Starting program.")
 
     try:
         pages: list[PageData] = fileutils.read_pagedata()
         broadcaster: broadcasts.Broadcaster = init_broadcaster()
+        digests: broadcasts.DigestQueue = init_digests()
         datautils.setup_db()
-        scout_pages(pages, broadcaster)
+        scout_pages(pages, broadcaster, digests)
     except KeyboardInterrupt:
         msg: str = "Interruption signal caught."
         loop = asyncio.get_event_loop()
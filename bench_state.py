@@ -0,0 +1,65 @@
+"""
+Compare loading and saving the whole watch state through JSON and the binary format.
+
+Run with ``python bench_state.py``.
+"""
+from datetime import datetime
+import json
+import timeit
+
+import fileutils
+from pagedata import PageData, PageSection
+
+PAGE_COUNT = 200
+SECTIONS_PER_PAGE = 100
+
+
+def build_pages() -> list[PageData]:
+    return [
+        PageData(
+            name=f"page{p}",
+            sections=[
+                PageSection(
+                    f"section{s}",
+                    f"https://www.isel.pt/page{p}/section{s}",
+                    "618ee903430da1f53c7295ff0f53ed9a",
+                    datetime(2023, 4, 25, 0, 3, 6),
+                    datetime(2023, 4, 25, 0, 4, 6),
+                )
+                for s in range(SECTIONS_PER_PAGE)
+            ],
+        )
+        for p in range(PAGE_COUNT)
+    ]
+
+
+def main() -> None:
+    pages: list[PageData] = build_pages()
+    raw_json: str = json.dumps(pages, cls=fileutils.HoardingJSONEncoder)
+    raw_state: bytes = fileutils.pack_state(pages)
+
+    def json_load() -> list[PageData]:
+        return [
+            PageData(
+                name=d["name"],
+                sections=[PageSection.from_dict(s) for s in d["sections"]],
+            )
+            for d in json.loads(raw_json)
+        ]
+
+    cases = [
+        ("json save", lambda: json.dumps(pages, cls=fileutils.HoardingJSONEncoder)),
+        ("json load", json_load),
+        ("binary save", lambda: fileutils.pack_state(pages)),
+        ("binary load", lambda: fileutils.unpack_state(raw_state)),
+    ]
+
+    print(f"{PAGE_COUNT * SECTIONS_PER_PAGE} sections")
+    print(f"json: {len(raw_json.encode())} bytes, binary: {len(raw_state)} bytes")
+    for name, fn in cases:
+        best: float = min(timeit.repeat(fn, number=5, repeat=3)) / 5
+        print(f"{name}: {best:.4f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,257 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import os
 import telegram
 from typing import Protocol
 
+from pagedata import PageChangeBroadcast, Subscription
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+TELEGRAM_SEND_INTERVAL = 1 / 30
+RETRY_AFTER_ATTEMPTS = 3
+DIGEST_DELIVERY_ATTEMPTS = 3
+DIGEST_STATE_VERSION = 1
+
+
+def split_message(message: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    """
+    Break a message into chunks under the limit, preferring line boundaries.
+
+    :message - message to split
+    :limit - maximum length of each chunk
+    """
+    chunks: list[str] = list()
+    current: str = ""
+    for line in message.split(os.linesep):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        candidate: str = f"{current}{os.linesep}{line}" if current else line
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class SubscriptionIndex:
+    """
+    Subscribers indexed by page and by section so a change only fans out to who follows it.
+    """
+
+    by_page: dict[str, set[str]]
+    by_section: dict[tuple[str, str], set[str]]
+
+    def __init__(self, subscriptions: list[Subscription] = None) -> None:
+        self.by_page = dict()
+        self.by_section = dict()
+        for sub in subscriptions or []:
+            self.subscribe(sub)
+
+    def subscribe(self, sub: Subscription) -> None:
+        if sub.section:
+            self.by_section.setdefault((sub.page, sub.section), set()).add(sub.chat_id)
+        else:
+            self.by_page.setdefault(sub.page, set()).add(sub.chat_id)
+
+    def subscribers_for(self, page: str, section: str) -> set[str]:
+        return self.by_page.get(page, set()) | self.by_section.get(
+            (page, section), set()
+        )
+
+
+@dataclass
+class DeliveryFailure:
+    delivered: int
+    error: Exception
+
+
+class DigestQueue:
+    """
+    Per subscriber batches of changes, released once their window has elapsed.
+    """
+
+    index: SubscriptionIndex
+    window: timedelta
+    pending: dict[str, list[PageChangeBroadcast]]
+    opened_at: dict[str, datetime]
+    attempts: dict[str, int]
+
+    def __init__(
+        self, index: SubscriptionIndex, window: timedelta, state: dict = None
+    ) -> None:
+        self.index = index
+        self.window = window
+        self.pending = dict()
+        self.opened_at = dict()
+        self.attempts = dict()
+        if state:
+            self.restore(state)
+
+    def to_dict(self) -> dict:
+        """
+        Dump pending digests to plain JSON types so they survive a restart.
+        """
+        return {
+            "version": DIGEST_STATE_VERSION,
+            "chats": {
+                chat_id: {
+                    "opened_at": self.opened_at[chat_id].isoformat(),
+                    "attempts": self.attempts.get(chat_id, 0),
+                    "changes": [
+                        {
+                            "page_name": change.page_name,
+                            "section_name": change.section_name,
+                            "timestamp": change.timestamp.isoformat(),
+                            "file_count": change.file_count,
+                        }
+                        for change in changes
+                    ],
+                }
+                for chat_id, changes in self.pending.items()
+            },
+        }
+
+    def restore(self, state: dict) -> None:
+        """
+        Load digests dumped by to_dict, refusing unknown versions with a ValueError.
+
+        :state - dumped digests
+        """
+        if state.get("version") != DIGEST_STATE_VERSION:
+            raise ValueError(f"Unsupported digest state version {state.get('version')}")
+        for chat_id, chat in state["chats"].items():
+            self.pending[chat_id] = [
+                PageChangeBroadcast(
+                    change["page_name"],
+                    change["section_name"],
+                    datetime.fromisoformat(change["timestamp"]),
+                    change["file_count"],
+                )
+                for change in chat["changes"]
+            ]
+            self.opened_at[chat_id] = datetime.fromisoformat(chat["opened_at"])
+            if chat["attempts"]:
+                self.attempts[chat_id] = chat["attempts"]
+
+    def push(self, changes: list[PageChangeBroadcast], now: datetime = None) -> None:
+        """
+        Route changes to the digest of everyone following them.
+
+        :changes - changes found in the last pass
+        :now - current time, defaults to utcnow
+        """
+        now = now or datetime.utcnow()
+        for change in changes:
+            for chat_id in self.index.subscribers_for(
+                change.page_name, change.section_name
+            ):
+                self.opened_at.setdefault(chat_id, now)
+                self.pending.setdefault(chat_id, list()).append(change)
+
+    def due(self, now: datetime = None) -> dict[str, list[PageChangeBroadcast]]:
+        """
+        Take the digests whose window has elapsed.
+
+        Taken digests must be handed back to settle once delivery was attempted.
+
+        :now - current time, defaults to utcnow
+        """
+        now = now or datetime.utcnow()
+        ready: dict[str, list[PageChangeBroadcast]] = dict()
+        for chat_id in [
+            id for id, opened in self.opened_at.items() if now - opened >= self.window
+        ]:
+            ready[chat_id] = self.pending.pop(chat_id)
+            del self.opened_at[chat_id]
+        return ready
+
+    def settle(
+        self,
+        sent: dict[str, list[list[PageChangeBroadcast]]],
+        failures: dict[str, DeliveryFailure],
+    ) -> dict[str, DeliveryFailure]:
+        """
+        Put the undelivered part of digests that failed for a temporary reason
+        back in front of the queue.
+
+        Digests are dropped when the chat rejects the bot for good or after
+        DIGEST_DELIVERY_ATTEMPTS passes without success.
+
+        :sent - digests taken from due, split with digest_chunks
+        :failures - how far each chat that was not fully reached got
+        """
+        dropped: dict[str, DeliveryFailure] = dict()
+        for chat_id, chunks in sent.items():
+            if chat_id not in failures:
+                self.attempts.pop(chat_id, None)
+                continue
+            failure: DeliveryFailure = failures[chat_id]
+            self.attempts[chat_id] = self.attempts.get(chat_id, 0) + 1
+            if (
+                is_permanent_failure(failure.error)
+                or self.attempts[chat_id] >= DIGEST_DELIVERY_ATTEMPTS
+            ):
+                self.attempts.pop(chat_id)
+                dropped[chat_id] = failure
+                continue
+            undelivered: list[PageChangeBroadcast] = [
+                change for chunk in chunks[failure.delivered :] for change in chunk
+            ]
+            self.pending[chat_id] = undelivered + self.pending.get(chat_id, list())
+            self.opened_at[chat_id] = datetime.min
+        return dropped
+
+
+def render_digest(changes: list[PageChangeBroadcast]) -> str:
+    return f"Updates on what you follow:{os.linesep}{os.linesep.join([entry.to_str() for entry in changes])}"
+
+
+def digest_chunks(
+    changes: list[PageChangeBroadcast], limit: int = TELEGRAM_MESSAGE_LIMIT
+) -> list[list[PageChangeBroadcast]]:
+    """
+    Group changes so each rendered digest fits in a single message.
+
+    :changes - changes of a single subscriber
+    :limit - maximum length of each rendered digest
+    """
+    header_length: int = len(render_digest([]))
+    chunks: list[list[PageChangeBroadcast]] = list()
+    length: int = 0
+    for change in changes:
+        line_length: int = len(change.to_str())
+        if chunks and length + len(os.linesep) + line_length <= limit:
+            chunks[-1].append(change)
+            length += len(os.linesep) + line_length
+        else:
+            chunks.append([change])
+            length = header_length + line_length
+    return chunks
+
+
+def is_permanent_failure(error: Exception) -> bool:
+    """
+    Tell apart chats that will never accept a message from passing hiccups.
+
+    :error - error raised while sending
+    """
+    return isinstance(
+        error,
+        (
+            telegram.error.Forbidden,
+            telegram.error.BadRequest,
+            telegram.error.ChatMigrated,
+        ),
+    )
+
 
 class SubscriberService(Protocol):
     owner: str
@@ -12,6 +263,9 @@ class SubscriberService(Protocol):
     def send_to_all(self, message: str) -> None:
         """Send message to all subscribers"""
 
+    def send_to(self, chat_id: str, message: str) -> None:
+        """Send message to a single subscriber"""
+
 
 class TelegramService:
     instance: telegram.Bot
@@ -27,12 +281,25 @@ class TelegramService:
 
     async def send_to_owner(self, message: str) -> None:
         """Send message to owner"""
-        await self.instance.send_message(chat_id=self.owner, text=message)
+        await self.send_to(self.owner, message)
 
     async def send_to_all(self, message: str) -> None:
         """Send message to all subscribers"""
         for id in self.subscriber_list:
-            await self.instance.send_message(chat_id=id, text=message)
+            await self.send_to(id, message)
+
+    async def send_to(self, chat_id: str, message: str) -> None:
+        """Send message to a single subscriber, waiting out flood limits"""
+        for chunk in split_message(message):
+            for attempt in range(RETRY_AFTER_ATTEMPTS):
+                try:
+                    await self.instance.send_message(chat_id=chat_id, text=chunk)
+                    break
+                except telegram.error.RetryAfter as e:
+                    if attempt == RETRY_AFTER_ATTEMPTS - 1:
+                        raise
+                    await asyncio.sleep(e.retry_after)
+            await asyncio.sleep(TELEGRAM_SEND_INTERVAL)
 
 
 class Broadcaster:
@@ -61,6 +328,29 @@ class Broadcaster:
         else:
             raise Exception("Telegram service not initialized")
 
+    async def to_subscribers(
+        self, digests: dict[str, list[str]]
+    ) -> dict[str, DeliveryFailure]:
+        """
+        Send each subscriber their own messages over all registered services.
+
+        A failing chat does not stop the others, how many of its messages got
+        through and the error are returned instead.
+
+        :digests - messages keyed by subscriber
+        """
+        failures: dict[str, DeliveryFailure] = dict()
+        if self.telegram_service:
+            for chat_id, messages in digests.items():
+                delivered: int = 0
+                try:
+                    for message in messages:
+                        await self.telegram_service.send_to(chat_id, message)
+                        delivered += 1
+                except telegram.error.TelegramError as e:
+                    failures[chat_id] = DeliveryFailure(delivered, e)
+        return failures
+
     async def to_owner(self, message: str) -> None:
         """
         Try to reach the owner over all channels.
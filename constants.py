@@ -1,4 +1,8 @@
 class AppFiles:
     DEFAULT_PAGES = "pagesDefaults.json"
     WORKING_PAGES = "pagesWorking.json"
+    WORKING_STATE = "pagesWorking.bin"
+    MIGRATED_PAGES = "pagesWorking.json.migrated"
     HISTORY = "pagesHistory.csv"
+    SUBSCRIPTIONS = "subscriptions.json"
+    DIGESTS = "digestsWorking.json"
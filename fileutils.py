@@ -3,10 +3,14 @@ from dataclasses import asdict
 import dataclasses
 from datetime import datetime
 import json
+import logging
+import os
 from pathlib import Path
+import struct
+from typing import Callable
 
 from constants import AppFiles
-from pagedata import PageData, PageHistory, PageSection
+from pagedata import PageData, PageHistory, PageSection, Subscription
 
 
 FILE_CONTENT_TYPES = {
@@ -15,13 +19,29 @@ FILE_CONTENT_TYPES = {
     "application/msword": ".doc",
 }
 
+STATE_MAGIC = b"HWS"
+STATE_VERSION = 2
+
+# Version 2 layout, little-endian, strings as UTF-8:
+#   magic, version byte, page count
+#   per page: name length, section count, name
+#   per section: name/url/hash lengths, last update and last attempt as
+#   microseconds since the epoch, then the name, url and hash bytes
+STATE_COUNT = struct.Struct("<I")
+STATE_PAGE = struct.Struct("<II")
+STATE_SECTION = struct.Struct("<IIIqq")
+NONE_LENGTH = 0xFFFFFFFF
+NONE_TIMESTAMP = -(2**63)
+
+logger = logging.getLogger(__name__)
+
 
 class HoardingJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if dataclasses.is_dataclass(obj):
             return dataclasses.asdict(obj)
         if isinstance(obj, PageSection):
-            return vars(obj)
+            return obj.to_dict()
         if isinstance(obj, datetime):
             return str(obj)
         return super().default(obj)
@@ -45,7 +65,12 @@ def write_file(
 
 
 def read_pagedata() -> list[PageData]:
-    data: dict
+    """
+    Load the freshest watch state that can be read.
+
+    The working JSON and the binary state are tried newest first, the
+    defaults are only used when neither of them loads.
+    """
 
     def read(file: Path) -> dict:
         with file.open() as f:
@@ -55,30 +80,202 @@ def read_pagedata() -> list[PageData]:
         d: dict
 
         return [
-            PageData(name=d["name"], sections=[PageSection(s) for s in d["sections"]])
+            PageData(
+                name=d["name"],
+                sections=[PageSection.from_dict(s) for s in d["sections"]],
+            )
             for d in data_dict
         ]
 
-    if Path(AppFiles.WORKING_PAGES).exists():
+    def read_working(file: Path) -> list[PageData]:
+        return deserialize(read(file))
+
+    candidates: list[tuple[Path, Callable[[Path], list[PageData]]]] = [
+        (Path(AppFiles.WORKING_STATE), read_state),
+        (Path(AppFiles.WORKING_PAGES), read_working),
+    ]
+    candidates = sorted(
+        [c for c in candidates if c[0].exists()],
+        key=lambda c: c[0].stat().st_mtime,
+        reverse=True,
+    )
+
+    for path, reader in candidates:
         try:
-            data = read(Path(AppFiles.WORKING_PAGES))
-        except json.JSONDecodeError:
-            data = read(Path(AppFiles.DEFAULT_PAGES))
-    elif Path(AppFiles.DEFAULT_PAGES).exists():
-        data = read(Path(AppFiles.DEFAULT_PAGES))
-    else:
+            return reader(path)
+        except (ValueError, KeyError, TypeError):
+            logger.exception(f"Could not read {path}, trying an older state.")
+
+    if not Path(AppFiles.DEFAULT_PAGES).exists():
         raise FileNotFoundError
 
-    return deserialize(data)
+    if candidates:
+        logger.error("No saved state could be read, loading the defaults.")
+    return deserialize(read(Path(AppFiles.DEFAULT_PAGES)))
+
+
+def read_subscriptions() -> list[Subscription]:
+    path: Path = Path(AppFiles.SUBSCRIPTIONS)
+    if not path.exists():
+        return []
+
+    with path.open() as f:
+        data: list[dict] = json.load(f)
+
+    return [
+        Subscription(str(d["chat_id"]), d["page"], d.get("section", None))
+        for d in data
+    ]
+
+
+def _pack_str(value: str | None) -> tuple[int, bytes]:
+    if value is None:
+        return NONE_LENGTH, b""
+    encoded: bytes = value.encode("UTF-8")
+    return len(encoded), encoded
+
+
+def pack_state(data: list[PageData]) -> bytes:
+    """
+    Serialize the watch state into the versioned binary format.
+
+    :data - pages to serialize
+    """
+    chunks: list[bytes] = [
+        STATE_MAGIC,
+        bytes([STATE_VERSION]),
+        STATE_COUNT.pack(len(data)),
+    ]
+    for p in data:
+        name_length, name = _pack_str(p.name)
+        chunks.append(STATE_PAGE.pack(name_length, len(p.sections)))
+        chunks.append(name)
+        for s in p.sections:
+            section_name, url, hash, last_update, last_attempt = s.to_record()
+            name_length, name = _pack_str(section_name)
+            url_length, url = _pack_str(url)
+            hash_length, hash = _pack_str(hash)
+            chunks.append(
+                STATE_SECTION.pack(
+                    name_length,
+                    url_length,
+                    hash_length,
+                    NONE_TIMESTAMP if last_update is None else last_update,
+                    NONE_TIMESTAMP if last_attempt is None else last_attempt,
+                )
+            )
+            chunks.extend([name, url, hash])
+    return b"".join(chunks)
+
+
+def unpack_state(raw: bytes) -> list[PageData]:
+    """
+    Deserialize the watch state, refusing unknown or damaged input with a ValueError.
+
+    :raw - bytes produced by pack_state
+    """
+    header_size: int = len(STATE_MAGIC) + 1
+    if len(raw) < header_size or raw[: len(STATE_MAGIC)] != STATE_MAGIC:
+        raise ValueError("Not a watch state file")
+    if raw[len(STATE_MAGIC)] != STATE_VERSION:
+        raise ValueError(f"Unsupported watch state version {raw[len(STATE_MAGIC)]}")
+
+    view: memoryview = memoryview(raw)
+    offset: int = header_size
+
+    def take_str(length: int) -> str | None:
+        nonlocal offset
+        if length == NONE_LENGTH:
+            return None
+        if offset + length > len(raw):
+            raise ValueError("Truncated watch state")
+        value: str = str(view[offset : offset + length], "UTF-8")
+        offset += length
+        return value
+
+    try:
+        (page_count,) = STATE_COUNT.unpack_from(raw, offset)
+        offset += STATE_COUNT.size
+        pages: list[PageData] = list()
+        for _ in range(page_count):
+            name_length, section_count = STATE_PAGE.unpack_from(raw, offset)
+            offset += STATE_PAGE.size
+            page_name: str = take_str(name_length)
+            sections: list[PageSection] = list()
+            for _ in range(section_count):
+                (
+                    name_length,
+                    url_length,
+                    hash_length,
+                    last_update,
+                    last_attempt,
+                ) = STATE_SECTION.unpack_from(raw, offset)
+                offset += STATE_SECTION.size
+                sections.append(
+                    PageSection(
+                        take_str(name_length),
+                        take_str(url_length),
+                        take_str(hash_length),
+                        None if last_update == NONE_TIMESTAMP else last_update,
+                        None if last_attempt == NONE_TIMESTAMP else last_attempt,
+                    )
+                )
+            pages.append(PageData(name=page_name, sections=sections))
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError("Corrupted watch state") from e
+
+    if offset != len(raw):
+        raise ValueError("Trailing data after watch state")
+    return pages
+
+
+def read_state(path: Path) -> list[PageData]:
+    with path.open("rb") as f:
+        return unpack_state(f.read())
+
+
+def replace_file(path: Path, content: bytes) -> None:
+    """
+    Write a file through a temporary sibling so a crash never leaves it half written.
+
+    :path - file to replace
+    :content - new content
+    """
+    temp: Path = path.with_name(f"{path.name}.tmp")
+
+    with temp.open("wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
 
 
 def write_pagedata(data: list[PageData]) -> None:
-    path: Path = Path(AppFiles.WORKING_PAGES)
+    replace_file(Path(AppFiles.WORKING_STATE), pack_state(data))
+
+    # Once the binary state holds everything, retire the working JSON so a later
+    # change to its mtime can never bring an old snapshot back.
+    working: Path = Path(AppFiles.WORKING_PAGES)
+    if working.exists():
+        os.replace(working, Path(AppFiles.MIGRATED_PAGES))
+        logger.info(f"Moved {working} to {AppFiles.MIGRATED_PAGES}.")
+
+
+def read_digests() -> dict:
+    path: Path = Path(AppFiles.DIGESTS)
     if not path.exists():
-        path.touch()
+        return {}
+
+    try:
+        with path.open() as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        logger.exception(f"Could not read {path}, pending digests are lost.")
+        return {}
 
-    with path.open("w") as f:
-        f.write(json.dumps(data, cls=HoardingJSONEncoder))
+
+def write_digests(data: dict) -> None:
+    replace_file(Path(AppFiles.DIGESTS), json.dumps(data).encode("UTF-8"))
 
 
 def write_history(page: str, url: str, hash: str, timestamp: datetime) -> None:
@@ -108,3 +305,4 @@ def write_page(
 
     with path.open("w+") as f:
         f.write(content)
+
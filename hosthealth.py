@@ -0,0 +1,193 @@
+from datetime import datetime, timedelta
+from enum import Enum
+import os
+from urllib.parse import urlparse
+
+import requests
+
+import datautils
+
+FAILURE_THRESHOLD = 3
+BASE_COOLDOWN = timedelta(minutes=15)
+MAX_COOLDOWN = timedelta(hours=6)
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+
+class HostHealth:
+    host: str
+    state: CircuitState
+    failures: int
+    trips: int
+    reopen_at: datetime
+    last_error: str
+
+    def __init__(self, host: str) -> None:
+        self.host = host
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.reopen_at = None
+        self.last_error = None
+
+    def to_str(self) -> str:
+        if self.reopen_at:
+            return f"{self.host} after {self.failures} failures ({self.last_error}), retrying at {self.reopen_at.strftime('%d-%m %H:%M')}"
+        return f"{self.host} after {self.failures} failures ({self.last_error})"
+
+
+def host_of(url: str) -> str:
+    return urlparse(url).netloc
+
+
+def parse_retry_after(value: str, now: datetime) -> datetime | None:
+    """
+    Turn a Retry-After header into an absolute time, accepting both seconds and HTTP dates.
+
+    :value - raw header value
+    :now - reference time for relative values
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return now + timedelta(seconds=int(value))
+    try:
+        return datetime.strptime(value, datautils.DATE_FORMAT_HEADER)
+    except ValueError:
+        return None
+
+
+def is_host_failure(rsp: requests.Response | None) -> bool:
+    """
+    Decide if a failed request says something about the host instead of the page.
+
+    :rsp - response that was rejected, if any came back at all
+    """
+    if rsp is None:
+        return True
+    return rsp.status_code == 429 or rsp.status_code >= 500
+
+
+class HostHealthTracker:
+    hosts: dict[str, HostHealth]
+    failure_threshold: int
+    base_cooldown: timedelta
+    max_cooldown: timedelta
+    newly_down: list[HostHealth]
+    recovered: list[HostHealth]
+
+    def __init__(
+        self,
+        failure_threshold: int = FAILURE_THRESHOLD,
+        base_cooldown: timedelta = BASE_COOLDOWN,
+        max_cooldown: timedelta = MAX_COOLDOWN,
+    ) -> None:
+        self.hosts = dict()
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.newly_down = list()
+        self.recovered = list()
+
+    def get(self, url: str) -> HostHealth:
+        host: str = host_of(url)
+        health: HostHealth = self.hosts.get(host)
+        if not health:
+            health = HostHealth(host)
+            self.hosts[host] = health
+        return health
+
+    def allow(self, url: str, now: datetime = None) -> bool:
+        """
+        Check if a request to the url's host should go out right now.
+
+        An open circuit lets a single probe through once its cooldown is over.
+
+        :url - resource about to be fetched
+        :now - current time, defaults to utcnow
+        """
+        health: HostHealth = self.get(url)
+        if health.state == CircuitState.OPEN:
+            if (now or datetime.utcnow()) < health.reopen_at:
+                return False
+            health.state = CircuitState.HALF_OPEN
+        return True
+
+    def record_success(self, url: str) -> None:
+        """
+        Close the circuit of the url's host.
+
+        :url - resource that was fetched successfully
+        """
+        health: HostHealth = self.get(url)
+        if health in self.newly_down:
+            self.newly_down.remove(health)
+        elif health.state != CircuitState.CLOSED:
+            self.recovered.append(health)
+        health.state = CircuitState.CLOSED
+        health.failures = 0
+        health.trips = 0
+        health.reopen_at = None
+        health.last_error = None
+
+    def record_failure(
+        self, url: str, rsp: requests.Response | None = None, now: datetime = None
+    ) -> None:
+        """
+        Count a failure against the url's host, opening its circuit when needed.
+
+        A failed half-open probe reopens the circuit with a doubled cooldown,
+        and a Retry-After header is honoured when it asks for a longer wait.
+
+        :url - resource that failed
+        :rsp - response that was rejected, if any came back at all
+        :now - current time, defaults to utcnow
+        """
+        now = now or datetime.utcnow()
+        health: HostHealth = self.get(url)
+        health.failures += 1
+        health.last_error = str(rsp.status_code) if rsp is not None else "no response"
+
+        retry_at: datetime = (
+            parse_retry_after(rsp.headers.get("retry-after"), now)
+            if rsp is not None
+            else None
+        )
+
+        if (
+            health.state == CircuitState.HALF_OPEN
+            or health.failures >= self.failure_threshold
+            or retry_at
+        ):
+            if health.state == CircuitState.CLOSED:
+                self.newly_down.append(health)
+            cooldown: timedelta = min(
+                self.base_cooldown * (2**health.trips), self.max_cooldown
+            )
+            health.trips += 1
+            health.state = CircuitState.OPEN
+            health.reopen_at = max(now + cooldown, retry_at or now)
+
+    def alerts(self) -> str | None:
+        """
+        Build a single message with every outage and recovery not yet reported.
+
+        They stay queued until clear_alerts is called, so a failed send can be retried.
+        """
+        lines: list[str] = list()
+        if self.newly_down:
+            lines.append("Hosts unreachable, pausing their sections:")
+            lines.extend([health.to_str() for health in self.newly_down])
+        if self.recovered:
+            lines.append("Hosts back online:")
+            lines.extend([health.host for health in self.recovered])
+        return os.linesep.join(lines) if lines else None
+
+    def clear_alerts(self) -> None:
+        self.newly_down.clear()
+        self.recovered.clear()
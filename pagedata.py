@@ -1,39 +1,116 @@
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _parse_timestamp(value: datetime | str | int | None) -> datetime | None:
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    if isinstance(value, int):
+        return EPOCH + timedelta(microseconds=value)
+    return value
+
+
+def _dump_timestamp(value: datetime | str | int | None) -> str | None:
+    if isinstance(value, str):
+        return value
+    if value is None:
+        return None
+    return str(_parse_timestamp(value))
+
+
+def _timestamp_micros(value: datetime | str | int | None) -> int | None:
+    if isinstance(value, int) or value is None:
+        return value
+    value = _parse_timestamp(value)
+    if value.tzinfo:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH) // timedelta(microseconds=1)
 
 
 class PageSection:
+    """
+    Watch state of a single section.
+
+    Timestamps may be kept as the ISO strings or epoch microseconds they were
+    loaded from and are only turned into datetimes when accessed.
+    """
+
+    __slots__ = ("name", "url", "last_hash", "_last_update", "_last_attempt")
+
     name: str
     url: str
     last_hash: str
-    last_update: datetime
-    last_attempt: datetime
-
-    def __init__(self, data: dict) -> None:
-        self.name = data["name"]
-        self.url = data["url"]
-        self.last_hash = data.get("last_hash", None)
-        self.last_update = (
-            datetime.fromisoformat(data["last_update"]) if data["last_update"] else None
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        last_hash: str = None,
+        last_update: datetime | str | int = None,
+        last_attempt: datetime | str | int = None,
+    ) -> None:
+        self.name = name
+        self.url = url
+        self.last_hash = last_hash
+        self._last_update = last_update if last_update != "" else None
+        self._last_attempt = last_attempt if last_attempt != "" else None
+
+    @property
+    def last_update(self) -> datetime:
+        self._last_update = _parse_timestamp(self._last_update)
+        return self._last_update
+
+    @last_update.setter
+    def last_update(self, value: datetime) -> None:
+        self._last_update = value
+
+    @property
+    def last_attempt(self) -> datetime:
+        self._last_attempt = _parse_timestamp(self._last_attempt)
+        return self._last_attempt
+
+    @last_attempt.setter
+    def last_attempt(self, value: datetime) -> None:
+        self._last_attempt = value
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "PageSection":
+        return cls(
+            data["name"],
+            data["url"],
+            data.get("last_hash", None),
+            data.get("last_update", None),
+            data.get("last_attempt", None),
         )
-        self.last_attempt = (
-            datetime.fromisoformat(data["last_attempt"])
-            if data["last_attempt"]
-            else None
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "url": self.url,
+            "last_hash": self.last_hash,
+            "last_update": _dump_timestamp(self._last_update),
+            "last_attempt": _dump_timestamp(self._last_attempt),
+        }
+
+    def to_record(self) -> tuple[str, str, str | None, int | None, int | None]:
+        return (
+            self.name,
+            self.url,
+            self.last_hash,
+            _timestamp_micros(self._last_update),
+            _timestamp_micros(self._last_attempt),
         )
 
 
+@dataclass(slots=True)
 class PageChangeBroadcast:
     page_name: str
     section_name: str
     timestamp: datetime
-    file_count: int
-
-    def __init__(self, page_name: str, section_name: str, timestamp: datetime) -> None:
-        self.page_name = page_name
-        self.section_name = section_name
-        self.timestamp = timestamp
-        self.file_count = 0
+    file_count: int = 0
 
     def to_str(self):
         if self.file_count:
@@ -42,6 +119,13 @@ class PageChangeBroadcast:
             return f"{self.section_name} of {self.page_name} at {self.timestamp.strftime('%d-%m %H:%M')}"
 
 
+@dataclass
+class Subscription:
+    chat_id: str
+    page: str
+    section: str = None
+
+
 @dataclass
 class PageData:
     name: str
@@ -0,0 +1,193 @@
+import asyncio
+from datetime import datetime, timedelta
+import json
+import os
+import unittest
+
+import telegram
+
+import broadcasts
+from broadcasts import DeliveryFailure, DigestQueue, SubscriptionIndex
+from pagedata import PageChangeBroadcast, Subscription
+
+NOW = datetime(2024, 1, 1, 12, 0)
+
+
+def change(section: str = "Calendar", page: str = "det") -> PageChangeBroadcast:
+    return PageChangeBroadcast(page, section, NOW)
+
+
+class FakeBot:
+    def __init__(self, failures: dict[str, list[Exception]] = None) -> None:
+        self.failures = failures or dict()
+        self.sent: list[tuple[str, str]] = list()
+
+    async def send_message(self, chat_id: str, text: str) -> None:
+        if self.failures.get(chat_id):
+            raise self.failures[chat_id].pop(0)
+        self.sent.append((chat_id, text))
+
+
+def broadcaster_for(bot: FakeBot) -> broadcasts.Broadcaster:
+    broadcaster = broadcasts.Broadcaster()
+    broadcaster.register_telegram(broadcasts.TelegramService(bot, "owner", ["owner"]))
+    return broadcaster
+
+
+class TestSplitMessage(unittest.TestCase):
+    def test_short_message_is_untouched(self):
+        self.assertEqual(broadcasts.split_message("hello", 10), ["hello"])
+
+    def test_splits_on_lines_at_the_limit(self):
+        message = os.linesep.join(["a" * 4, "b" * 4, "c" * 4])
+        chunks = broadcasts.split_message(message, 4 + len(os.linesep) + 4)
+        self.assertEqual(chunks, [f"aaaa{os.linesep}bbbb", "cccc"])
+
+    def test_cuts_lines_longer_than_the_limit(self):
+        chunks = broadcasts.split_message("x" * 25, 10)
+        self.assertEqual(chunks, ["x" * 10, "x" * 10, "x" * 5])
+
+    def test_every_chunk_fits_telegram(self):
+        message = os.linesep.join(["y" * 100] * 200)
+        chunks = broadcasts.split_message(message)
+        self.assertTrue(
+            all(len(c) <= broadcasts.TELEGRAM_MESSAGE_LIMIT for c in chunks)
+        )
+        self.assertEqual(os.linesep.join(chunks), message)
+
+
+class TestDigestChunks(unittest.TestCase):
+    def test_each_rendered_chunk_fits(self):
+        changes = [change("s" * 50) for _ in range(300)]
+        chunks = broadcasts.digest_chunks(changes)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual([c for chunk in chunks for c in chunk], changes)
+        for chunk in chunks:
+            self.assertLessEqual(
+                len(broadcasts.render_digest(chunk)), broadcasts.TELEGRAM_MESSAGE_LIMIT
+            )
+
+    def test_small_digest_is_one_chunk(self):
+        changes = [change(), change("Main Page")]
+        self.assertEqual(broadcasts.digest_chunks(changes), [changes])
+
+
+class TestSubscriptionIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = SubscriptionIndex(
+            [
+                Subscription("1", "det"),
+                Subscription("1", "det", "Calendar"),
+                Subscription("2", "det", "Calendar"),
+                Subscription("3", "m23"),
+            ]
+        )
+
+    def test_page_and_section_followers_are_merged_once(self):
+        self.assertEqual(self.index.subscribers_for("det", "Calendar"), {"1", "2"})
+
+    def test_other_sections_reach_page_followers_only(self):
+        self.assertEqual(self.index.subscribers_for("det", "Main Page"), {"1"})
+
+    def test_unfollowed_page(self):
+        self.assertEqual(self.index.subscribers_for("other", "Main Page"), set())
+
+    def test_queue_sends_one_copy_per_chat(self):
+        queue = DigestQueue(self.index, timedelta(0))
+        queue.push([change()], NOW)
+        self.assertEqual(queue.due(NOW), {"1": [change()], "2": [change()]})
+
+
+class TestDigestQueue(unittest.TestCase):
+    def setUp(self):
+        self.index = SubscriptionIndex([Subscription("1", "det")])
+        self.queue = DigestQueue(self.index, timedelta(minutes=30))
+
+    def test_window_batches_changes(self):
+        self.queue.push([change()], NOW)
+        self.queue.push([change("Main Page")], NOW + timedelta(minutes=10))
+        self.assertEqual(self.queue.due(NOW + timedelta(minutes=29)), {})
+        ready = self.queue.due(NOW + timedelta(minutes=30))
+        self.assertEqual(ready, {"1": [change(), change("Main Page")]})
+        self.assertEqual(self.queue.due(NOW + timedelta(days=1)), {})
+
+    def take(self) -> dict[str, list[list[PageChangeBroadcast]]]:
+        return {
+            chat_id: [[c] for c in changes]
+            for chat_id, changes in self.queue.due(NOW + timedelta(hours=1)).items()
+        }
+
+    def test_settle_forgets_delivered_digests(self):
+        self.queue.push([change()], NOW)
+        self.assertEqual(self.queue.settle(self.take(), {}), {})
+        self.assertEqual(self.queue.pending, {})
+
+    def test_settle_requeues_only_undelivered_changes(self):
+        self.queue.push([change(), change("Main Page")], NOW)
+        failure = DeliveryFailure(1, telegram.error.NetworkError("down"))
+        self.assertEqual(self.queue.settle(self.take(), {"1": failure}), {})
+        self.assertEqual(self.queue.due(NOW), {"1": [change("Main Page")]})
+
+    def test_settle_drops_permanent_failures(self):
+        self.queue.push([change()], NOW)
+        failure = DeliveryFailure(0, telegram.error.Forbidden("blocked"))
+        self.assertEqual(self.queue.settle(self.take(), {"1": failure}), {"1": failure})
+        self.assertEqual(self.queue.pending, {})
+
+    def test_settle_drops_after_repeated_temporary_failures(self):
+        self.queue.push([change()], NOW)
+        failure = DeliveryFailure(0, telegram.error.NetworkError("down"))
+        for _ in range(broadcasts.DIGEST_DELIVERY_ATTEMPTS - 1):
+            self.assertEqual(self.queue.settle(self.take(), {"1": failure}), {})
+        self.assertEqual(self.queue.settle(self.take(), {"1": failure}), {"1": failure})
+        self.assertEqual(self.queue.pending, {})
+
+    def test_state_survives_a_json_round_trip(self):
+        self.queue.push([change()], NOW)
+        failure = DeliveryFailure(0, telegram.error.NetworkError("down"))
+        self.queue.settle(self.take(), {"1": failure})
+        self.queue.push([change("Main Page")], NOW)
+        state = json.loads(json.dumps(self.queue.to_dict()))
+        restored = DigestQueue(self.index, timedelta(minutes=30), state)
+        self.assertEqual(restored.pending, self.queue.pending)
+        self.assertEqual(restored.opened_at, self.queue.opened_at)
+        self.assertEqual(restored.attempts, self.queue.attempts)
+
+    def test_unknown_state_version_is_refused(self):
+        with self.assertRaises(ValueError):
+            DigestQueue(self.index, timedelta(0), {"version": 99, "chats": {}})
+
+
+class TestBroadcaster(unittest.TestCase):
+    def test_failing_chat_does_not_stop_the_others(self):
+        bot = FakeBot({"1": [telegram.error.Forbidden("blocked")]})
+        failures = asyncio.run(
+            broadcaster_for(bot).to_subscribers({"1": ["a"], "2": ["b"]})
+        )
+        self.assertEqual(list(failures), ["1"])
+        self.assertEqual(bot.sent, [("2", "b")])
+
+    def test_reports_how_many_messages_got_through(self):
+        bot = FakeBot()
+        original = bot.send_message
+
+        async def fail_on_second(chat_id: str, text: str) -> None:
+            if text == "second":
+                raise telegram.error.NetworkError("down")
+            await original(chat_id, text)
+
+        bot.send_message = fail_on_second
+        failures = asyncio.run(
+            broadcaster_for(bot).to_subscribers({"1": ["first", "second", "third"]})
+        )
+        self.assertEqual(failures["1"].delivered, 1)
+
+    def test_flood_limit_is_waited_out(self):
+        bot = FakeBot({"1": [telegram.error.RetryAfter(0)]})
+        failures = asyncio.run(broadcaster_for(bot).to_subscribers({"1": ["a"]}))
+        self.assertEqual(failures, {})
+        self.assertEqual(bot.sent, [("1", "a")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta
+import unittest
+
+import requests
+
+import hosthealth
+from hosthealth import CircuitState, HostHealthTracker
+
+URL = "https://www.isel.pt/servicos"
+OTHER_URL = "https://example.com/page"
+NOW = datetime(2024, 1, 1, 12, 0)
+
+
+def response(status_code: int, retry_after: str = None) -> requests.Response:
+    rsp = requests.Response()
+    rsp.status_code = status_code
+    if retry_after is not None:
+        rsp.headers["Retry-After"] = retry_after
+    return rsp
+
+
+def trip(tracker: HostHealthTracker, url: str = URL) -> None:
+    for _ in range(tracker.failure_threshold):
+        tracker.record_failure(url, now=NOW)
+
+
+class TestHelpers(unittest.TestCase):
+    def test_retry_after_seconds(self):
+        self.assertEqual(
+            hosthealth.parse_retry_after(" 120 ", NOW), NOW + timedelta(seconds=120)
+        )
+
+    def test_retry_after_http_date(self):
+        self.assertEqual(
+            hosthealth.parse_retry_after("Mon, 01 Jan 2024 13:00:00 GMT", NOW),
+            datetime(2024, 1, 1, 13, 0),
+        )
+
+    def test_retry_after_garbage(self):
+        self.assertIsNone(hosthealth.parse_retry_after("soon", NOW))
+        self.assertIsNone(hosthealth.parse_retry_after(None, NOW))
+
+    def test_host_failures(self):
+        self.assertTrue(hosthealth.is_host_failure(None))
+        self.assertTrue(hosthealth.is_host_failure(response(503)))
+        self.assertTrue(hosthealth.is_host_failure(response(429)))
+        self.assertFalse(hosthealth.is_host_failure(response(404)))
+
+
+class TestHostHealthTracker(unittest.TestCase):
+    def setUp(self):
+        self.tracker = HostHealthTracker()
+
+    def test_trips_after_threshold(self):
+        for _ in range(self.tracker.failure_threshold - 1):
+            self.tracker.record_failure(URL, now=NOW)
+            self.assertTrue(self.tracker.allow(URL, NOW))
+        self.tracker.record_failure(URL, now=NOW)
+        self.assertEqual(self.tracker.get(URL).state, CircuitState.OPEN)
+        self.assertFalse(self.tracker.allow(URL, NOW))
+
+    def test_other_hosts_keep_going(self):
+        trip(self.tracker)
+        self.assertTrue(self.tracker.allow(OTHER_URL, NOW))
+
+    def test_retry_after_opens_immediately_and_wins_when_longer(self):
+        self.tracker.record_failure(URL, response(503, "86400"), NOW)
+        health = self.tracker.get(URL)
+        self.assertEqual(health.state, CircuitState.OPEN)
+        self.assertEqual(health.reopen_at, NOW + timedelta(days=1))
+
+    def test_half_open_probe_after_cooldown(self):
+        trip(self.tracker)
+        later = NOW + hosthealth.BASE_COOLDOWN
+        self.assertTrue(self.tracker.allow(URL, later))
+        self.assertEqual(self.tracker.get(URL).state, CircuitState.HALF_OPEN)
+
+    def test_failed_probe_doubles_cooldown(self):
+        trip(self.tracker)
+        later = NOW + hosthealth.BASE_COOLDOWN
+        self.tracker.allow(URL, later)
+        self.tracker.record_failure(URL, now=later)
+        health = self.tracker.get(URL)
+        self.assertEqual(health.state, CircuitState.OPEN)
+        self.assertEqual(health.reopen_at, later + 2 * hosthealth.BASE_COOLDOWN)
+
+    def test_cooldown_is_capped(self):
+        tracker = HostHealthTracker(max_cooldown=timedelta(minutes=20))
+        trip(tracker)
+        moment = NOW
+        for _ in range(5):
+            moment = tracker.get(URL).reopen_at
+            tracker.allow(URL, moment)
+            tracker.record_failure(URL, now=moment)
+        self.assertEqual(tracker.get(URL).reopen_at, moment + timedelta(minutes=20))
+
+    def test_successful_probe_recovers(self):
+        trip(self.tracker)
+        self.tracker.clear_alerts()
+        self.tracker.allow(URL, NOW + hosthealth.BASE_COOLDOWN)
+        self.tracker.record_success(URL)
+        health = self.tracker.get(URL)
+        self.assertEqual(health.state, CircuitState.CLOSED)
+        self.assertEqual(health.failures, 0)
+        self.assertIn("back online", self.tracker.alerts())
+
+    def test_alerts_are_aggregated_and_kept_until_cleared(self):
+        trip(self.tracker)
+        trip(self.tracker, OTHER_URL)
+        message = self.tracker.alerts()
+        self.assertIn("www.isel.pt", message)
+        self.assertIn("example.com", message)
+        self.assertEqual(self.tracker.alerts(), message)
+        self.tracker.clear_alerts()
+        self.assertIsNone(self.tracker.alerts())
+
+    def test_unreported_outage_that_recovers_is_not_announced(self):
+        trip(self.tracker)
+        self.tracker.allow(URL, NOW + hosthealth.BASE_COOLDOWN)
+        self.tracker.record_success(URL)
+        self.assertIsNone(self.tracker.alerts())
+
+
+if __name__ == "__main__":
+    unittest.main()
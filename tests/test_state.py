@@ -0,0 +1,221 @@
+from datetime import datetime, timedelta, timezone
+import json
+import os
+from pathlib import Path
+import tempfile
+import unittest
+
+from constants import AppFiles
+import fileutils
+from pagedata import PageData, PageSection
+
+
+def section_values(pages: list[PageData]) -> list:
+    return [
+        (
+            p.name,
+            s.name,
+            s.url,
+            s.last_hash,
+            s.last_update,
+            s.last_attempt,
+        )
+        for p in pages
+        for s in p.sections
+    ]
+
+
+def sample_pages() -> list[PageData]:
+    return [
+        PageData(
+            name="m23",
+            sections=[
+                PageSection(
+                    "Main Page",
+                    "https://www.isel.pt/m23",
+                    "618ee903430da1f53c7295ff0f53ed9a",
+                    datetime(2023, 4, 25, 0, 3, 6, 120),
+                    datetime(2023, 4, 25, 0, 4, 6),
+                ),
+                PageSection("Calendário", "https://www.isel.pt/m23/calendarios"),
+            ],
+        ),
+        PageData(name="empty", sections=[]),
+    ]
+
+
+class TestStateRoundTrip(unittest.TestCase):
+    def test_round_trip_keeps_every_field(self):
+        pages = sample_pages()
+        self.assertEqual(
+            section_values(fileutils.unpack_state(fileutils.pack_state(pages))),
+            section_values(pages),
+        )
+
+    def test_none_values_survive(self):
+        section = fileutils.unpack_state(fileutils.pack_state(sample_pages()))[0]
+        section = section.sections[1]
+        self.assertIsNone(section.last_hash)
+        self.assertIsNone(section.last_update)
+        self.assertIsNone(section.last_attempt)
+
+    def test_lazy_strings_match_parsed_datetimes(self):
+        lazy = PageSection.from_dict(
+            {
+                "name": "Main Page",
+                "url": "https://www.isel.pt/m23",
+                "last_hash": "abc",
+                "last_update": "2023-04-25 00:03:06.000120",
+                "last_attempt": "",
+            }
+        )
+        parsed = PageSection(
+            "Main Page",
+            "https://www.isel.pt/m23",
+            "abc",
+            datetime(2023, 4, 25, 0, 3, 6, 120),
+        )
+        self.assertEqual(lazy.to_record(), parsed.to_record())
+        self.assertEqual(lazy.last_update, parsed.last_update)
+        self.assertIsNone(lazy.last_attempt)
+
+    def test_aware_timestamps_are_stored_as_utc(self):
+        aware = PageSection(
+            "a",
+            "b",
+            last_update=datetime(
+                2023, 4, 25, 1, 0, tzinfo=timezone(timedelta(hours=1))
+            ),
+        )
+        restored = fileutils.unpack_state(
+            fileutils.pack_state([PageData(name="p", sections=[aware])])
+        )
+        self.assertEqual(restored[0].sections[0].last_update, datetime(2023, 4, 25))
+
+    def test_json_keeps_unparsed_strings(self):
+        section = PageSection.from_dict(
+            {
+                "name": "a",
+                "url": "b",
+                "last_update": "2023-04-25 00:03:06",
+                "last_attempt": None,
+            }
+        )
+        dumped = json.loads(json.dumps(section, cls=fileutils.HoardingJSONEncoder))
+        self.assertEqual(dumped["last_update"], "2023-04-25 00:03:06")
+        self.assertIsNone(dumped["last_attempt"])
+
+
+class TestStateRejection(unittest.TestCase):
+    def setUp(self):
+        self.raw = fileutils.pack_state(sample_pages())
+
+    def test_rejects_wrong_magic(self):
+        with self.assertRaises(ValueError):
+            fileutils.unpack_state(b"XYZ" + self.raw[3:])
+
+    def test_rejects_unknown_version(self):
+        raw = self.raw[:3] + bytes([fileutils.STATE_VERSION + 1]) + self.raw[4:]
+        with self.assertRaises(ValueError):
+            fileutils.unpack_state(raw)
+
+    def test_rejects_every_truncation(self):
+        for size in range(len(self.raw)):
+            with self.subTest(size=size), self.assertRaises(ValueError):
+                fileutils.unpack_state(self.raw[:size])
+
+    def test_rejects_trailing_data(self):
+        with self.assertRaises(ValueError):
+            fileutils.unpack_state(self.raw + b"\x00")
+
+    def test_rejects_invalid_text(self):
+        name_at = self.raw.index(b"m23")
+        raw = self.raw[:name_at] + b"\xff" + self.raw[name_at + 1 :]
+        with self.assertRaises(ValueError):
+            fileutils.unpack_state(raw)
+
+
+class TestReadPagedata(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.TemporaryDirectory()
+        os.chdir(self.dir.name)
+        Path(AppFiles.DEFAULT_PAGES).write_text(
+            json.dumps(
+                [
+                    {
+                        "name": "defaults",
+                        "sections": [
+                            {
+                                "name": "Main Page",
+                                "url": "https://www.isel.pt/",
+                                "last_hash": None,
+                                "last_update": None,
+                                "last_attempt": None,
+                            }
+                        ],
+                    }
+                ]
+            )
+        )
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.dir.cleanup()
+
+    def write_working_json(self, mtime: float) -> None:
+        path = Path(AppFiles.WORKING_PAGES)
+        path.write_text(json.dumps([{"name": "working", "sections": []}]))
+        os.utime(path, (mtime, mtime))
+
+    def test_write_then_read(self):
+        fileutils.write_pagedata(sample_pages())
+        self.assertEqual(
+            section_values(fileutils.read_pagedata()), section_values(sample_pages())
+        )
+        self.assertFalse(Path(f"{AppFiles.WORKING_STATE}.tmp").exists())
+
+    def test_older_json_is_ignored(self):
+        fileutils.write_pagedata(sample_pages())
+        self.write_working_json(Path(AppFiles.WORKING_STATE).stat().st_mtime - 60)
+        self.assertEqual(fileutils.read_pagedata()[0].name, "m23")
+
+    def test_newer_json_wins(self):
+        fileutils.write_pagedata(sample_pages())
+        self.write_working_json(Path(AppFiles.WORKING_STATE).stat().st_mtime + 60)
+        self.assertEqual(fileutils.read_pagedata()[0].name, "working")
+
+    def test_corrupt_state_falls_back_to_older_json(self):
+        Path(AppFiles.WORKING_STATE).write_bytes(b"HWS")
+        self.write_working_json(Path(AppFiles.WORKING_STATE).stat().st_mtime - 60)
+        with self.assertLogs(fileutils.logger, "ERROR"):
+            pages = fileutils.read_pagedata()
+        self.assertEqual(pages[0].name, "working")
+
+    def test_corrupt_newer_json_falls_back_to_state(self):
+        fileutils.write_pagedata(sample_pages())
+        path = Path(AppFiles.WORKING_PAGES)
+        path.write_text("[{")
+        mtime = Path(AppFiles.WORKING_STATE).stat().st_mtime + 60
+        os.utime(path, (mtime, mtime))
+        with self.assertLogs(fileutils.logger, "ERROR"):
+            pages = fileutils.read_pagedata()
+        self.assertEqual(pages[0].name, "m23")
+
+    def test_defaults_only_when_nothing_loads(self):
+        Path(AppFiles.WORKING_STATE).write_bytes(b"HWS")
+        Path(AppFiles.WORKING_PAGES).write_text("[{")
+        with self.assertLogs(fileutils.logger, "ERROR"):
+            pages = fileutils.read_pagedata()
+        self.assertEqual(pages[0].name, "defaults")
+
+    def test_write_retires_working_json(self):
+        self.write_working_json(0)
+        fileutils.write_pagedata(sample_pages())
+        self.assertFalse(Path(AppFiles.WORKING_PAGES).exists())
+        self.assertTrue(Path(AppFiles.MIGRATED_PAGES).exists())
+        os.utime(AppFiles.MIGRATED_PAGES)
+        self.assertEqual(fileutils.read_pagedata()[0].name, "m23")
+
+if __name__ == "__main__":
+    unittest.main()